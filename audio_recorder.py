@@ -26,14 +26,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import logging
 
 import math
+import threading
 import time
 
 import numpy as np
 import pyaudio
-import queue
+from scipy import signal
 
 logger = logging.getLogger(__name__)
 
@@ -46,15 +48,15 @@ class TimeoutError(Exception):
 class AudioRecorder(object):
   """Asynchronously record and buffer audio using pyaudio.
 
-  This class wraps the pyaudio interface. It contains a queue.Queue object to
-  hold chunks of raw audio, and a callback function _enqueue_audio() which
-  places raw audio into this queue. This allows the pyaudio.Stream object to
+  This class wraps the pyaudio interface. It contains a bounded deque to hold
+  chunks of raw audio, and a callback function _enqueue_raw_audio() which
+  places raw audio into this deque. This allows the pyaudio.Stream object to
   record asynchronously at low latency.
 
   The class acts as a context manager. When entering the context it creates a
   pyaudio.Stream object and starts recording; it stops recording on exit. The
-  Stream saves all of its audio to the Queue as two-tuples of
-  (timestamp, raw_audio). The raw_audio is available from the queue as a numpy
+  Stream saves all of its audio to the deque as two-tuples of
+  (raw_audio, timestamp). The raw_audio is available from the deque as a numpy
   array using the get_audio() function.
 
   This class uses the term "frame" in the same sense that PortAudio does, so
@@ -62,6 +64,12 @@ class AudioRecorder(object):
   A frame in PortAudio is one audio sample across all channels, so one frame of
   16-bit stereo audio is four bytes of data as two 16-bit integers.
   """
+  # Instance attributes are slotted so hot-path self.foo lookups skip the
+  # per-instance dict.
+  __slots__ = ('_downsample_factor', '_raw_audio_sample_rate_hz',
+               'audio_sample_rate_hz', '_raw_audio_deque', '_audio_ready',
+               '_decode_buf', '_audio', '_device_index', '_stream')
+
   pyaudio_format = pyaudio.paInt16
   numpy_format = np.int16
   num_channels = 1
@@ -83,7 +91,16 @@ class AudioRecorder(object):
     self._downsample_factor = downsample_factor
     self._raw_audio_sample_rate_hz = raw_audio_sample_rate_hz
     self.audio_sample_rate_hz = self._raw_audio_sample_rate_hz // self._downsample_factor
-    self._raw_audio_queue = queue.Queue(self.max_queue_chunks)
+    # One producer (the PortAudio callback thread) and one consumer, so a
+    # bounded deque plus a single wakeup Event replaces queue.Queue and its
+    # per-put/per-get lock round trips. deque.append/popleft are atomic.
+    self._raw_audio_deque = collections.deque(maxlen=self.max_queue_chunks)
+    self._audio_ready = threading.Event()
+    # Decoded chunks are written straight into this preallocated buffer, so
+    # the hot path never allocates per-chunk arrays or concatenates them.
+    self._decode_buf = np.empty(
+        (self.max_queue_chunks, self.frames_per_chunk, self.num_channels),
+        dtype=self.numpy_format)
     self._audio = pyaudio.PyAudio()
     self._print_input_devices()
     self._device_index = device_index
@@ -143,19 +160,33 @@ class AudioRecorder(object):
       print("  ID: ", i, " - ", device_info.get("name"))
 
   def _enqueue_raw_audio(self, in_data, *_):  # unused args to match expected
-    try:
-      self._raw_audio_queue.put((in_data, time.time()), block=False)
-      return None, pyaudio.paContinue
-    except queue.Full:
-      error_message = "Raw audio buffer full."
-      logger.critical(error_message)
-      raise TimeoutError(error_message)
-
-  def _get_chunk(self, timeout=None):
-    raw_data, timestamp = self._raw_audio_queue.get(timeout=timeout)
-    array_data = np.fromstring(raw_data, self.numpy_format).reshape(
-        -1, self.num_channels)
-    return array_data, timestamp
+    # This runs on the PortAudio callback thread; it must never raise, or
+    # PortAudio aborts the stream. With maxlen set, append drops the oldest
+    # chunk on overflow instead of blocking.
+    raw_deque = self._raw_audio_deque
+    if len(raw_deque) == self.max_queue_chunks:
+      logger.critical("Raw audio buffer full; dropping oldest chunk.")
+    raw_deque.append((in_data, time.time()))
+    self._audio_ready.set()
+    return None, pyaudio.paContinue
+
+  def _get_chunk(self, slot, timeout=None):
+    """Decode one raw chunk into the given slot of the decode buffer."""
+    raw_deque = self._raw_audio_deque
+    audio_ready = self._audio_ready
+    while not raw_deque:
+      audio_ready.clear()
+      # Re-check after clearing in case the producer appended in between.
+      if not raw_deque and not audio_ready.wait(timeout):
+        error_message = "Audio capture timed out after %.1f seconds." % timeout
+        logger.critical(error_message)
+        raise TimeoutError(error_message)
+    raw_data, timestamp = raw_deque.popleft()
+    # np.frombuffer is a zero-copy view of the PortAudio bytes; the slot
+    # assignment is the only copy made.
+    self._decode_buf[slot] = np.frombuffer(
+        raw_data, dtype=self.numpy_format).reshape(-1, self.num_channels)
+    return timestamp
 
   def get_audio_device_info(self):
     if self._device_index is None:
@@ -167,9 +198,8 @@ class AudioRecorder(object):
     return num_samples / self.audio_sample_rate_hz / self.num_channels
 
   def clear_queue(self):
-    logger.debug("Purging %d chunks from queue.", self._raw_audio_queue.qsize())
-    while not self._raw_audio_queue.empty():
-      self._raw_audio_queue.get()
+    logger.debug("Purging %d chunks from queue.", len(self._raw_audio_deque))
+    self._raw_audio_deque.clear()
 
   def get_audio(self, num_audio_frames):
     """Grab at least num_audio_frames frames of audio.
@@ -193,28 +223,25 @@ class AudioRecorder(object):
                  num_audio_chunks, num_audio_frames)
     if num_audio_chunks < 1:
       num_audio_chunks = 1
-    try:
-      timeout = self.timeout_factor * self._chunk_duration_seconds
-      chunks, timestamps = zip(
-          *[self._get_chunk(timeout=timeout) for _ in range(num_audio_chunks)])
-    except queue.Empty:
-      error_message = "Audio capture timed out after %.1f seconds." % timeout
-      logger.critical(error_message)
-      raise TimeoutError(error_message)
-
-    assert len(chunks) == num_audio_chunks
-    logger.debug("Got %d chunks. Chunk 0 has shape %s and dtype %s.",
-                 len(chunks), chunks[0].shape, chunks[0].dtype)
-    if self._raw_audio_queue.qsize() > (0.8 * self.max_queue_chunks):
-      logger.warning("%d chunks remain in the queue.",
-                     self._raw_audio_queue.qsize())
+    timeout = self.timeout_factor * self._chunk_duration_seconds
+    timestamps = [self._get_chunk(slot, timeout=timeout)
+                  for slot in range(num_audio_chunks)]
+
+    logger.debug("Got %d chunks.", num_audio_chunks)
+    queued_chunks = len(self._raw_audio_deque)
+    if queued_chunks > (0.8 * self.max_queue_chunks):
+      logger.warning("%d chunks remain in the queue.", queued_chunks)
     else:
-      logger.debug("%d chunks remain in the queue.",
-                   self._raw_audio_queue.qsize())
+      logger.debug("%d chunks remain in the queue.", queued_chunks)
 
-    audio = np.concatenate(chunks)
+    # A reshape of the filled slots is a view of the decode buffer, not a copy.
+    audio = self._decode_buf[:num_audio_chunks].reshape(-1, self.num_channels)
     if self._downsample_factor != 1:
-      audio = audio[::self._downsample_factor]
+      # Polyphase resampling applies an anti-aliasing FIR filter, unlike the
+      # naive audio[::downsample_factor] stride slice, and runs in one
+      # vectorized pass.
+      audio = signal.resample_poly(
+          audio, 1, self._downsample_factor, axis=0).astype(self.numpy_format)
     logging.debug("Audio array has shape %s and dtype %s.", audio.shape,
                   audio.dtype)
-    return audio * 0.5, timestamps[0], timestamps[-1]
+    return audio, timestamps[0], timestamps[-1]
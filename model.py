@@ -19,10 +19,12 @@ from __future__ import print_function
 
 import logging
 import sys
+import threading
 import audio_recorder
 import mel_features
 import numpy as np
 import queue
+import scipy.fft
 import tflite_runtime.interpreter as tflite
 import platform
 
@@ -64,12 +66,37 @@ class Uint8LogMelFeatureExtractor(object):
                                              self.frame_length_spectra))
     self.frame_hop_spectra = num_frames_hop
     self._norm_factor = 3
+    # STFT window and mel filterbank are derived from the audio sample rate,
+    # which is only known once audio arrives; computed lazily and reused.
+    self._stft_params = None
     self._clear_buffers()
 
   def _clear_buffers(self):
-    self._audio_buffer = np.array([], dtype=np.int16).reshape(0, 1)
+    # Frame buffer holding the overlap carried from the previous hop followed
+    # by newly captured audio; sized on first use, then reused so stitching
+    # hops never concatenates.
+    self._frame_buf = np.empty(0, dtype=np.int16)
+    self._carry_len = 0
+    # The spectrogram state is a ring buffer over rows: each hop overwrites
+    # the oldest frame_hop_spectra rows in place instead of shifting the
+    # whole array. frame_length_spectra % frame_hop_spectra == 0 (checked in
+    # __init__), so a hop never wraps mid-write.
     self._spectrogram = np.zeros((self.frame_length_spectra, self.num_mel_bins),
                                  dtype=np.float32)
+    self._spectrogram_write_idx = 0
+    # float32 scratch for the int16 -> float sample scaling; grown on first
+    # use to the hop size, then reused.
+    self._float_scratch = np.empty(0, dtype=np.float32)
+    # Scratch for the normalize-to-uint8 step; reused so normalization never
+    # allocates on the per-hop path.
+    self._norm_scratch = np.empty_like(self._spectrogram)
+    # Rotating uint8 output buffers. A single buffer is not enough because
+    # the prefetch pipeline in classify_audio keeps frames in flight: up to
+    # two queued, one held by the consumer, one being written here.
+    self._uint8_outputs = [
+        np.empty((self.frame_length_spectra, self.num_mel_bins), np.uint8)
+        for _ in range(4)]
+    self._uint8_output_idx = 0
 
   def _spectrogram_underlap_samples(self, audio_sample_rate_hz):
     return int((self.spectrogram_window_length_seconds -
@@ -79,33 +106,63 @@ class Uint8LogMelFeatureExtractor(object):
     return (self.spectrogram_window_length_seconds +
             (num_spectra - 1) * self.spectrogram_hop_length_seconds)
 
-  def _compute_spectrogram(self, audio_samples, audio_sample_rate_hz):
-    """Compute log-mel spectrogram and scale it to uint8."""
-    samples = audio_samples.flatten() / float(2**15)
-    spectrogram = 30 * (
-        mel_features.log_mel_spectrogram(
-            samples,
-            audio_sample_rate_hz,
-            log_offset=0.001,
-            window_length_secs=self.spectrogram_window_length_seconds,
-            hop_length_secs=self.spectrogram_hop_length_seconds,
-            num_mel_bins=self.num_mel_bins,
-            lower_edge_hertz=60,
-            upper_edge_hertz=3800) - np.log(1e-3))
-    return spectrogram
-
-  def _get_next_spectra(self, recorder, num_spectra):
-    """Returns the next spectrogram.
+  def _setup_stft_params(self, audio_sample_rate_hz):
+    """Precompute the STFT window and mel filterbank for this sample rate."""
+    window_length_samples = int(round(
+        audio_sample_rate_hz * self.spectrogram_window_length_seconds))
+    hop_length_samples = int(round(
+        audio_sample_rate_hz * self.spectrogram_hop_length_seconds))
+    fft_length = 2 ** int(np.ceil(np.log(window_length_samples) / np.log(2.0)))
+    self._window = mel_features.periodic_hann(
+        window_length_samples).astype(np.float32)
+    self._mel_matrix = mel_features.spectrogram_to_mel_matrix(
+        num_mel_bins=self.num_mel_bins,
+        num_spectrogram_bins=fft_length // 2 + 1,
+        audio_sample_rate=audio_sample_rate_hz,
+        lower_edge_hertz=60,
+        upper_edge_hertz=3800).astype(np.float32)
+    self._stft_params = (audio_sample_rate_hz, window_length_samples,
+                         hop_length_samples, fft_length)
+
+  def _compute_spectrogram(self, audio_samples, audio_sample_rate_hz, out):
+    """Compute the log-mel spectrogram directly into the out array."""
+    if self._stft_params is None or self._stft_params[0] != audio_sample_rate_hz:
+      self._setup_stft_params(audio_sample_rate_hz)
+    _, window_length_samples, hop_length_samples, fft_length = self._stft_params
+    # Scale int16 samples to [-1, 1) as float32 in a reused scratch buffer:
+    # float32 halves the memory traffic of the default float64 promotion and
+    # keeps the whole FFT/matmul chain single precision.
+    num_samples = audio_samples.size
+    if self._float_scratch.size < num_samples:
+      self._float_scratch = np.empty(num_samples, dtype=np.float32)
+    samples = self._float_scratch[:num_samples]
+    np.multiply(audio_samples.reshape(-1), np.float32(1.0 / 2**15),
+                out=samples, casting='unsafe')
+    # Same computation as mel_features.log_mel_spectrogram, but with the
+    # window and mel matrix cached across calls instead of rebuilt per hop.
+    frames = mel_features.frame(samples, window_length_samples,
+                                hop_length_samples)
+    magnitude = np.abs(
+        scipy.fft.rfft(frames * self._window, fft_length, workers=-1))
+    # The mel projection and 30 * (log(mel + 1e-3) - log(1e-3)) scaling are
+    # computed in place in the destination rows.
+    np.dot(magnitude, self._mel_matrix, out=out)
+    out += 0.001
+    np.log(out, out=out)
+    out -= np.log(1e-3)
+    out *= 30
+
+  def _get_next_spectra(self, recorder, num_spectra, out):
+    """Computes the next spectrogram slices into the out array.
 
     Compute num_spectra spectrogram samples from an AudioRecorder.
     Blocks until num_spectra spectrogram slices are available.
 
     Args:
       recorder: an AudioRecorder object from which to get raw audio samples.
-      num_spectra: the number of spectrogram slices to return.
-
-    Returns:
-      num_spectra spectrogram slices computed from the samples.
+      num_spectra: the number of spectrogram slices to compute.
+      out: float32 destination array of shape (num_spectra, num_mel_bins);
+        written in place so no intermediate spectrogram is allocated.
     """
     required_audio_duration_seconds = self._frame_duration_seconds(num_spectra)
     logger.info("required_audio_duration_seconds %f",
@@ -113,18 +170,28 @@ class Uint8LogMelFeatureExtractor(object):
     required_num_samples = int(
         np.ceil(required_audio_duration_seconds *
                 recorder.audio_sample_rate_hz))
-    logger.info("required_num_samples %d, %s", required_num_samples,
-                str(self._audio_buffer.shape))
-    audio_samples = np.concatenate(
-        (self._audio_buffer,
-         recorder.get_audio(required_num_samples - len(self._audio_buffer))[0]))
-    self._audio_buffer = audio_samples[
-        required_num_samples -
-        self._spectrogram_underlap_samples(recorder.audio_sample_rate_hz):]
-    spectrogram = self._compute_spectrogram(
-        audio_samples[:required_num_samples], recorder.audio_sample_rate_hz)
-    assert len(spectrogram) == num_spectra
-    return spectrogram
+    carry_len = self._carry_len
+    logger.info("required_num_samples %d, carry %d", required_num_samples,
+                carry_len)
+    new_audio = recorder.get_audio(
+        required_num_samples - carry_len)[0].reshape(-1)
+    total_samples = carry_len + new_audio.size
+    if self._frame_buf.size < total_samples:
+      frame_buf = np.empty(total_samples, dtype=np.int16)
+      frame_buf[:carry_len] = self._frame_buf[:carry_len]
+      self._frame_buf = frame_buf
+    self._frame_buf[carry_len:total_samples] = new_audio
+    self._compute_spectrogram(
+        self._frame_buf[:required_num_samples], recorder.audio_sample_rate_hz,
+        out)
+    # Carry the window overlap (plus any extra captured samples) to the front
+    # of the buffer for the next hop.
+    carry_start = (required_num_samples -
+                   self._spectrogram_underlap_samples(
+                       recorder.audio_sample_rate_hz))
+    self._carry_len = total_samples - carry_start
+    self._frame_buf[:self._carry_len] = (
+        self._frame_buf[carry_start:total_samples])
 
   def get_next_spectrogram(self, recorder):
     """Get the most recent spectrogram frame.
@@ -135,42 +202,61 @@ class Uint8LogMelFeatureExtractor(object):
       recorder: an AudioRecorder instance which provides the audio samples.
 
     Returns:
-      The next spectrogram frame as a uint8 numpy array.
+      The next spectrogram frame as a uint8 numpy array. The array comes
+      from a small pool of reused output buffers, so it stays valid across
+      the handful of in-flight frames of the inference pipeline but should
+      be copied if persisted beyond that.
     """
     assert recorder.is_active
     logger.info("self._spectrogram shape %s", str(self._spectrogram.shape))
-    self._spectrogram[:-self.frame_hop_spectra] = (
-        self._spectrogram[self.frame_hop_spectra:])
-    self._spectrogram[-self.frame_hop_spectra:] = (
-        self._get_next_spectra(recorder, self.frame_hop_spectra))
-    # Return a copy of the internal state that's safe to persist and won't
-    # change the next time we call this function.
+    write_idx = self._spectrogram_write_idx
+    self._get_next_spectra(
+        recorder, self.frame_hop_spectra,
+        self._spectrogram[write_idx:write_idx + self.frame_hop_spectra])
+    self._spectrogram_write_idx = (
+        (write_idx + self.frame_hop_spectra) % self.frame_length_spectra)
+    # Materialize the ring in chronological order into a reused scratch
+    # buffer, then normalize it in place; the ring state is left untouched
+    # and nothing is allocated per hop.
     logger.info("self._spectrogram shape %s", str(self._spectrogram.shape))
-    spectrogram = self._spectrogram.copy()
-    spectrogram -= np.mean(spectrogram, axis=0)
+    spectrogram = self._norm_scratch
+    oldest = self._spectrogram_write_idx
+    num_newer = self.frame_length_spectra - oldest
+    spectrogram[:num_newer] = self._spectrogram[oldest:]
+    spectrogram[num_newer:] = self._spectrogram[:oldest]
+    mean = spectrogram.mean(axis=0)
     if self._norm_factor:
-      spectrogram /= self._norm_factor * np.std(spectrogram, axis=0)
-      spectrogram += 1
-      spectrogram *= 127.5
-    return np.maximum(0, np.minimum(255, spectrogram)).astype(np.uint8)
+      # (x - mean) / (norm * std) * 127.5 + 127.5, folded into one
+      # multiply-add pass per element.
+      scale = 127.5 / (self._norm_factor * spectrogram.std(axis=0))
+      spectrogram -= mean
+      np.multiply(spectrogram, scale, out=spectrogram)
+      spectrogram += 127.5
+    else:
+      spectrogram -= mean
+    np.clip(spectrogram, 0, 255, out=spectrogram)
+    out = self._uint8_outputs[self._uint8_output_idx]
+    self._uint8_output_idx = (
+        (self._uint8_output_idx + 1) % len(self._uint8_outputs))
+    np.copyto(out, spectrogram, casting='unsafe')
+    return out
 
 
 def read_labels(filename):
   # The labels file can be made something like this.
-  f = open(filename, "r")
-  lines = f.readlines()
-  return ['negative'] + [l.rstrip() for l in lines]
+  with open(filename, "r") as f:
+    return ['negative'] + [line.rstrip() for line in f]
 
 
 def read_commands(filename):
   # commands should consist of a label, a command and a confidence.
-  f = open(filename, "r")
   commands = {}
-  lines = f.readlines()
-  for command, key, confidence in [l.rstrip().split(',') for l in lines]:
-    commands[command] = { 'key': key, 'conf': 0.4}
-    if confidence and 0 <= float(confidence) <= 1:
-      commands[command]['conf'] = float(confidence)
+  with open(filename, "r") as f:
+    for line in f:
+      command, key, confidence = line.rstrip().split(',')
+      commands[command] = {'key': key, 'conf': 0.4}
+      if confidence and 0 <= float(confidence) <= 1:
+        commands[command]['conf'] = float(confidence)
   return commands
 
 
@@ -178,28 +264,88 @@ def get_output(interpreter):
     """Returns entire output, threshold is applied later."""
     return output_tensor(interpreter, 0)
 
+def _output_details(interpreter, i):
+    """Returns output details dict i, cached on the interpreter.
+
+    Like get_input_details(), get_output_details() builds fresh dicts per
+    call; the result is static after tensor allocation, so cache it.
+    """
+    try:
+        return interpreter._cached_output_details[i]
+    except AttributeError:
+        interpreter._cached_output_details = interpreter.get_output_details()
+        return interpreter._cached_output_details[i]
+
+
+def _tensor_fn(interpreter, tensor_index):
+    """Returns the interpreter.tensor() callable, cached on the interpreter."""
+    try:
+        fns = interpreter._cached_tensor_fns
+    except AttributeError:
+        fns = interpreter._cached_tensor_fns = {}
+    if tensor_index not in fns:
+        fns[tensor_index] = interpreter.tensor(tensor_index)
+    return fns[tensor_index]
+
+
+def _make_output_fn(interpreter, i):
+    """Builds a getter for output i specialized to its shape/quantization.
+
+    Shape and quantization parameters are fixed once tensors are allocated,
+    so the squeeze and dequantization branches are resolved here once rather
+    than re-evaluated on every inference.
+    """
+    output_details = _output_details(interpreter, i)
+    tensor_fn = _tensor_fn(interpreter, output_details['index'])
+    shape = output_details['shape']
+    if len(shape) == 2 and shape[0] == 1:
+        # The usual [1, num_classes] case: unbatch by indexing instead of
+        # np.squeeze, which constructs an extra view object per call.
+        unbatch = lambda: tensor_fn()[0]
+    else:
+        unbatch = lambda: np.squeeze(tensor_fn())
+    scale, zero_point = output_details.get('quantization', (0, 0))
+    if scale == 0:
+        if zero_point == 0:
+            return unbatch
+        return lambda: unbatch() - zero_point
+    return lambda: scale * (unbatch() - zero_point)
+
+
 def output_tensor(interpreter, i):
     """Returns dequantized output tensor if quantized before."""
-    output_details = interpreter.get_output_details()[i]
-    output_data = np.squeeze(interpreter.tensor(output_details['index'])())
-    if 'quantization' not in output_details:
-        return output_data
-    scale, zero_point = output_details['quantization']
-    if scale == 0:
-        return output_data - zero_point
-    return scale * (output_data - zero_point)
+    try:
+        fns = interpreter._cached_output_fns
+    except AttributeError:
+        fns = interpreter._cached_output_fns = {}
+    if i not in fns:
+        fns[i] = _make_output_fn(interpreter, i)
+    return fns[i]()
+
+
+def _input_details(interpreter):
+    """Returns the first input details dict, cached on the interpreter.
+
+    get_input_details() builds a fresh list of dicts on every call, so cache
+    the result the first time; the details are static once tensors are
+    allocated.
+    """
+    try:
+        return interpreter._cached_input_details
+    except AttributeError:
+        interpreter._cached_input_details = interpreter.get_input_details()[0]
+        return interpreter._cached_input_details
 
 
 def input_tensor(interpreter):
     """Returns the input tensor view as numpy array."""
-    tensor_index = interpreter.get_input_details()[0]['index']
-    return interpreter.tensor(tensor_index)()[0]
+    return _tensor_fn(interpreter, _input_details(interpreter)['index'])()[0]
 
 
 def set_input(interpreter, data):
     """Copies data to input tensor."""
-    interpreter_shape = interpreter.get_input_details()[0]['shape']
-    input_tensor(interpreter)[:,:] = np.reshape(data, interpreter_shape[1:3])
+    np.copyto(input_tensor(interpreter),
+              data.reshape(_input_details(interpreter)['shape'][1:3]))
 
 
 def make_interpreter(model_file):
@@ -257,33 +403,70 @@ def classify_audio(audio_device_index, interpreter, labels_file,
     commands = {}
   logger.info("Loaded commands: %s", str(commands))
   logger.info("Recording")
+  # Precomputed for the detection loop: membership and confidence lookups by
+  # integer label id, so the per-inference path never hashes label strings or
+  # rebuilds commands.keys().
+  label_ids = {label: idx for idx, label in enumerate(labels)}
+  command_ids = frozenset(
+      label_ids[label] for label in commands if label in label_ids)
+  command_confs = np.zeros(len(labels), np.float32)
+  is_command = np.zeros(len(labels), bool)
+  for label, command in commands.items():
+    if label in label_ids:
+      command_confs[label_ids[label]] = command['conf']
+      is_command[label_ids[label]] = True
   timed_out = False
   with recorder:
+    # Capture + feature extraction run on a worker thread feeding a small
+    # queue, so the next spectrogram is prepared while the Edge TPU runs the
+    # current one (interpreter.invoke releases the GIL). Errors from the
+    # worker (e.g. a capture timeout) are handed over and re-raised here.
+    spectrogram_queue = queue.Queue(maxsize=2)
+    shutdown = threading.Event()
+
+    def prefetch_spectrograms():
+      try:
+        while not shutdown.is_set():
+          spectrogram_queue.put(feature_extractor.get_next_spectrogram(recorder))
+      except Exception as error:  # pylint: disable=broad-except
+        spectrogram_queue.put(error)
+
+    prefetcher = threading.Thread(target=prefetch_spectrograms)
+    prefetcher.daemon = True
+    prefetcher.start()
     last_detection = -1
-    while not timed_out:
-      spectrogram = feature_extractor.get_next_spectrogram(recorder)
-      set_input(interpreter, spectrogram.flatten())
-      interpreter.invoke()
-      result = get_output(interpreter)
-      if result_callback:
-        result_callback(result, commands, labels)
-      if dectection_callback:
-        detection = -1
-        if result[0] < negative_threshold:
-          top3 = np.argsort(-result)[:3]
-          for p in range(3):
-            label = labels[top3[p]]
-            if label not in commands.keys():
-              continue
-            if top3[p] and result[top3[p]] > commands[label]['conf']:
-              if detection < 0:
-                detection = top3[p]
-        if detection < 0 and last_detection > 0:
-          print("---------------")
-          last_detection = 0
-        if labels[detection] in commands.keys() and detection != last_detection:
-          print(labels[detection], commands[labels[detection]])
-          dectection_callback(commands[labels[detection]]['key'])
-          last_detection = detection
-      if spectrogram.mean() < 0.001:
-        print("Warning: Input audio signal is nearly 0. Mic may be off ?")
+    try:
+      while not timed_out:
+        spectrogram = spectrogram_queue.get()
+        if isinstance(spectrogram, Exception):
+          raise spectrogram
+        # set_input reshapes as needed; flatten() here would copy.
+        set_input(interpreter, spectrogram)
+        interpreter.invoke()
+        result = get_output(interpreter)
+        if result_callback:
+          result_callback(result, commands, labels)
+        if dectection_callback:
+          detection = -1
+          if result[0] < negative_threshold:
+            # Top-3 selection: argpartition is O(N), then only the three
+            # survivors are sorted, instead of argsort over all labels.
+            top3 = np.argpartition(result, -3)[-3:]
+            top3 = top3[np.argsort(-result[top3])]
+            # Candidate filter as one vectorized mask over the ranked ids:
+            # known command, not the negative class, above its confidence.
+            hits = top3[is_command[top3] & (top3 != 0) &
+                        (result[top3] > command_confs[top3])]
+            if hits.size:
+              detection = int(hits[0])
+          if detection < 0 and last_detection > 0:
+            print("---------------")
+            last_detection = 0
+          if detection in command_ids and detection != last_detection:
+            print(labels[detection], commands[labels[detection]])
+            dectection_callback(commands[labels[detection]]['key'])
+            last_detection = detection
+        if spectrogram.mean() < 0.001:
+          print("Warning: Input audio signal is nearly 0. Mic may be off ?")
+    finally:
+      shutdown.set()
@@ -17,12 +17,13 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import bisect
 import json
+import multiprocessing
 import os
 from random import randint
-from threading import Thread
-import time
 import model
+import numpy as np
 import pygame
 from pygame.locals import *
 import queue
@@ -34,6 +35,31 @@ GAMESTART_TEXT_COLOR = pygame.Color('yellow')
 SCORE_TEXT_COLOR = pygame.Color('magenta')
 NUMBER_OF_SCORES_TO_KEEP = 10
 
+# Sprite surfaces shared by all Player/Apple instances. PNG decode,
+# convert_alpha and the rotations are per-pixel work that only needs to
+# happen once per process; convert_alpha requires an active display, so the
+# cache is filled lazily on first use (after App.on_init set the mode).
+_SPRITES = {}
+
+
+def _load_sprites():
+  if not _SPRITES:
+    head_right = pygame.image.load(
+        'pygame_images/snake_head_with_ears.png').convert_alpha()
+    tail_right = pygame.image.load(
+        'pygame_images/snake_tail.png').convert_alpha()
+    _SPRITES.update(
+        apple=pygame.image.load('pygame_images/apple.png').convert_alpha(),
+        head_right=head_right,
+        head_left=pygame.transform.rotate(head_right, 180),
+        head_up=pygame.transform.rotate(head_right, 90),
+        head_down=pygame.transform.rotate(head_right, 270),
+        tail_right=tail_right,
+        tail_left=pygame.transform.rotate(tail_right, 180),
+        tail_up=pygame.transform.rotate(tail_right, 90),
+        tail_down=pygame.transform.rotate(tail_right, 270))
+  return _SPRITES
+
 
 class Apple:
   x = 0
@@ -54,8 +80,12 @@ class Apple:
     self.y = self._start_y * self.step
     self._display_width = display_width
     self._display_height = display_height
-    self._apple_image = pygame.image.load(
-        'pygame_images/apple.png').convert_alpha()
+    # Respawn grid bounds, keeping a border where the apple never appears;
+    # computed once instead of per respawn.
+    self._border = 2
+    self._width_bound = int(round(display_width / self.size)) - self._border
+    self._height_bound = int(round(display_height / self.size)) - self._border
+    self._apple_image = _load_sprites()['apple']
 
   def draw(self, surface):
     if self._apple_image is not None:
@@ -64,19 +94,17 @@ class Apple:
       pygame.draw.rect(surface, self.color,
                        (self.x, self.y, self.size, self.size), 0)
 
+  def rect(self):
+    return pygame.Rect(self.x, self.y, self.size, self.size)
+
   def respan(self):
-    # generate next apple position by keeping a border where we don't want
-    # the apple to appear
-    border = 2
-    width_bound = int(round(self._display_width / self.size)) - border
-    height_bound = int(round(self._display_height / self.size)) - border
-    self.x = randint(border, width_bound) * self.size
-    self.y = randint(border, height_bound) * self.size
+    # generate next apple position within the precomputed grid bounds
+    self.x = randint(self._border, self._width_bound) * self.size
+    self.y = randint(self._border, self._height_bound) * self.size
 
 
 class Player:
-  x = [0]
-  y = [0]
+  pos = None
   block_size = 30
   step = block_size
   color = SNAKE_COLOR
@@ -99,39 +127,59 @@ class Player:
   _snake_tail_up = None
   _snake_tail_down = None
 
-  _update_count_max = 2
+  # The snake advances every _update_count_max + 1 loop ticks. The main loop
+  # runs at a fixed 30Hz, so 12 keeps the shipped voice-mode cadence of
+  # roughly 450ms per cell (~433ms here) that the old ~150ms loop iteration
+  # produced with a max of 2.
+  _update_count_max = 12
   _update_count = 0
   _need_immediate_pos_update = False
 
+  # Body storage capacity; the body is a ring inside the pos array indexed
+  # from _head, so a move is an O(1) head write instead of an O(length)
+  # shift. Segment i lives at (_head + i) % _capacity.
+  _capacity = 2048
+  _head = 0
+
+  # (dx, dy) unit steps per direction: 0 right, 1 left, 2 up, 3 down.
+  _DIRS = ((1, 0), (-1, 0), (0, -1), (0, 1))
+
   def __init__(self, length, display_width, display_height):
     self._display_width = display_width
     self._display_height = display_height
-    self._snake_head_right = pygame.image.load(
-        'pygame_images/snake_head_with_ears.png').convert_alpha()
-    self._snake_head_left = pygame.transform.rotate(self._snake_head_right, 180)
-    self._snake_head_up = pygame.transform.rotate(self._snake_head_right, 90)
-    self._snake_head_down = pygame.transform.rotate(self._snake_head_right, 270)
-    self._snake_tail_right = pygame.image.load(
-        'pygame_images/snake_tail.png').convert_alpha()
-    self._snake_tail_left = pygame.transform.rotate(self._snake_tail_right, 180)
-    self._snake_tail_up = pygame.transform.rotate(self._snake_tail_right, 90)
-    self._snake_tail_down = pygame.transform.rotate(self._snake_tail_right, 270)
+    sprites = _load_sprites()
+    self._snake_head_right = sprites['head_right']
+    self._snake_head_left = sprites['head_left']
+    self._snake_head_up = sprites['head_up']
+    self._snake_head_down = sprites['head_down']
+    self._snake_tail_right = sprites['tail_right']
+    self._snake_tail_left = sprites['tail_left']
+    self._snake_tail_up = sprites['tail_up']
+    self._snake_tail_down = sprites['tail_down']
+    # One shared body-block surface, blitted for every middle segment instead
+    # of a per-segment pygame.draw.rect call.
+    self._body_surf = pygame.Surface((self.block_size, self.block_size))
+    self._body_surf.fill(self.color)
+    # Per-direction (dx, dy) step rows and the toroidal wrap bounds, shaped
+    # to combine with pos rows in a single vector op.
+    self._dir_steps = np.array(self._DIRS, dtype=np.int32) * self.step
+    self._wrap = np.array([display_width, display_height], dtype=np.int32)
     self.restart(length)
 
   def restart(self, length):
     self.length = length
     self._update_count = 0
     self._direction = 0
-    self.x = [0]
-    self.y = [0]
-    for _ in range(0, 2000):
-      self.x.append(-100)
-      self.y.append(-100)
+    # Packed body storage: each segment is a contiguous (x, y) int32 row, so
+    # a move touches one 8-byte row and collision tests are single
+    # broadcasted row comparisons instead of parallel per-axis passes.
+    self.pos = np.full((self._capacity, 2), -100, dtype=np.int32)
+    self._head = 0
+    self._segment_offsets = np.arange(self._capacity)
+    self.pos[0] = (0, 0)
     # initial positions, no collision.
-    self.x[1] = -1 * self.block_size
-    self.x[2] = -2 * self.block_size
-    self.y[1] = 0
-    self.y[2] = 0
+    self.pos[1] = (-1 * self.block_size, 0)
+    self.pos[2] = (-2 * self.block_size, 0)
     self._direction = 0
     self._snake_head_image = self._snake_head_right
     self._snake_head_image_width = self._snake_head_image.get_rect().width
@@ -140,35 +188,43 @@ class Player:
     self.update()
 
   def update(self):
+    """Advances the snake if due; returns True if it moved."""
     self._update_count = self._update_count + 1
     if self._need_immediate_pos_update or self._update_count > self._update_count_max:
       self.update_position_immediately()
       self._update_count = 0
       self._need_immediate_pos_update = False
+      return True
+    return False
+
+  def segment_positions(self, start=0):
+    """Returns the body cells ordered head to tail as an (n, 2) array of
+    (x, y) rows."""
+    indices = ((self._head + self._segment_offsets[start:self.length]) %
+               self._capacity)
+    return self.pos[indices]
+
+  @property
+  def head_pos(self):
+    return self.pos[self._head]
+
+  @property
+  def head_x(self):
+    return self.pos[self._head, 0]
+
+  @property
+  def head_y(self):
+    return self.pos[self._head, 1]
 
   def update_position_immediately(self):
-    # update previous positions
-    for i in range(self.length - 1, 0, -1):
-      self.x[i] = self.x[i - 1]
-      self.y[i] = self.y[i - 1]
-
-    # update position of head of snake
-    if self._direction == 0:
-      self.x[0] = self.x[0] + self.step
-      if self.x[0] > self._display_width:
-        self.x[0] = self.x[0] - self._display_width - self.step
-    if self._direction == 1:
-      self.x[0] = self.x[0] - self.step
-      if self.x[0] < 0:
-        self.x[0] += self._display_width
-    if self._direction == 2:
-      self.y[0] = self.y[0] - self.step
-      if self.y[0] < 0:
-        self.y[0] += self._display_height
-    if self._direction == 3:
-      self.y[0] = self.y[0] + self.step
-      if self.y[0] > self._display_height:
-        self.y[0] = self.y[0] - self._display_height - self.step
+    # O(1) move: previous positions stay put in the ring; only the new head
+    # row is written. Step and toroidal wrap apply to both axes in one
+    # fused row operation.
+    head = self._head
+    new_head = (head - 1) % self._capacity
+    self.pos[new_head] = (self.pos[head] +
+                          self._dir_steps[self._direction]) % self._wrap
+    self._head = new_head
 
     # update traveled distance
     self.traveled_dist += self.step
@@ -194,51 +250,82 @@ class Player:
       self._need_immediate_pos_update = True
 
   def grow(self):
+    # Duplicate the current tail into the new tail slot; the ring cell there
+    # holds a stale position from many moves ago.
+    tail = (self._head + self.length - 1) % self._capacity
+    new_tail = (self._head + self.length) % self._capacity
+    self.pos[new_tail] = self.pos[tail]
     self.length += 1
 
+  def _draw_head(self, surface, cells):
+    # Only the head depends on the current direction; the wrap checks
+    # against the neck suppress drawing mid-teleport.
+    direction = self._direction
+    head_offset = round(self._snake_head_image_height / 2 -
+                        self.block_size / 2)
+    x, y = cells[0]
+    neck_x, neck_y = cells[1]
+    if direction == 0 or direction == 1:
+      half_width = self._display_width / 2
+      y -= head_offset
+      if direction == 0 and (x > neck_x or (neck_x - x) > half_width):
+        surface.blit(self._snake_head_right, (x, y))
+      elif direction == 1 and (x < neck_x or (x - neck_x) > half_width):
+        surface.blit(self._snake_head_left, (x, y))
+    else:
+      half_height = self._display_height / 2
+      x -= head_offset
+      if direction == 2 and (y < neck_y or (y - neck_y) > half_height):
+        surface.blit(self._snake_head_up, (x, y))
+      elif direction == 3 and (y > neck_y or (neck_y - y) < half_height):
+        surface.blit(self._snake_head_down, (x, y))
+
+  def _draw_tail(self, surface, cells):
+    x, y = cells[-1]
+    prev_x, prev_y = cells[-2]
+    if x < prev_x:
+      surface.blit(self._snake_tail_right, (x, y))
+    elif x > prev_x:
+      surface.blit(self._snake_tail_left, (x, y))
+    elif y < prev_y:
+      surface.blit(self._snake_tail_down, (x, y))
+    elif y > prev_y:
+      surface.blit(self._snake_tail_up, (x, y))
+
   def draw(self, surface):
+    # Three straight sections (tail, middle bulk, head on top) instead of
+    # one loop re-branching on i == 0 / i == length - 1 every iteration.
+    # tolist() converts the packed rows to plain int pairs in one C pass,
+    # avoiding a numpy-scalar unboxing per coordinate below.
     length = self.length
-    for i in range(length - 1, -1, -1):
-      if i == 0:
-        if self._direction == 0 or self._direction == 1:
-          x = self.x[i]
-          y = self.y[i] - round(self._snake_head_image_height / 2 -
-                                self.block_size / 2)
-          if self._direction == 0 and (x > self.x[i + 1] or (self.x[i + 1] - x) > self._display_width / 2):
-            surface.blit(self._snake_head_right, (x, y))
-          elif self._direction == 1 and (x < self.x[i + 1] or (x - self.x[i + 1]) > self._display_width / 2):
-            surface.blit(self._snake_head_left, (x, y))
-        else:
-          x = self.x[i] - round(self._snake_head_image_height / 2 -
-                                self.block_size / 2)
-          y = self.y[i]
-          if self._direction == 2 and (y < self.y[i + 1] or (y - self.y[i + 1]) > self._display_height / 2):
-            surface.blit(self._snake_head_up, (x, y))
-          elif self._direction == 3 and (y > self.y[i + 1] or (self.y[i + 1] - y) < self._display_height / 2):
-            surface.blit(self._snake_head_down, (x, y))
-      elif i == length - 1:
-        x = self.x[i]
-        y = self.y[i]
-        if x < self.x[i - 1]:
-          surface.blit(self._snake_tail_right, (x, y))
-        elif x > self.x[i - 1]:
-          surface.blit(self._snake_tail_left, (x, y))
-        elif y < self.y[i - 1]:
-          surface.blit(self._snake_tail_down, (x, y))
-        elif y > self.y[i - 1]:
-          surface.blit(self._snake_tail_up, (x, y))
-      else:
-        pygame.draw.rect(
-            surface, self.color,
-            (self.x[i], self.y[i], self.block_size, self.block_size), 0)
+    cells = self.segment_positions().tolist()
+    if length > 1:
+      self._draw_tail(surface, cells)
+    if length > 2:
+      body_surf = self._body_surf
+      # One C-level loop inside pygame instead of a Python call per segment.
+      surface.blits([(body_surf, cell) for cell in cells[1:length - 1]],
+                    doreturn=0)
+    self._draw_head(surface, cells)
+
+  def dirty_rects(self):
+    """Screen rects covered by the snake: one per cell, oversized for the
+    head since its sprite is larger than a block and drawn with an offset."""
+    cells = self.segment_positions().tolist()
+    block_size = self.block_size
+    rects = [pygame.Rect(x, y, block_size, block_size) for x, y in cells]
+    head_offset = round(self._snake_head_image_height / 2 - block_size / 2)
+    max_dim = max(self._snake_head_image_width, self._snake_head_image_height)
+    head_x, head_y = cells[0]
+    rects[0] = pygame.Rect(head_x - head_offset, head_y - head_offset,
+                           max_dim + head_offset, max_dim + head_offset)
+    return rects
 
   def is_collision(self, block_index):
-    if self.x[0] >= self.x[block_index] and self.x[
-        0] < self.x[block_index] + self.block_size:
-      if self.y[0] >= self.y[block_index] and self.y[
-          0] < self.y[block_index] + self.block_size:
-        return True
-    return False
+    block = (self._head + block_index) % self._capacity
+    cell = self.pos[block]
+    head = self.pos[self._head]
+    return bool(((head >= cell) & (head < cell + self.block_size)).all())
 
 
 class Game:
@@ -256,6 +343,10 @@ class Game:
   _coef = 1
   _snake_to_apple_dist = -1
   _gameover_text = ''
+  _font = None
+  # Cached (surface, rect) pairs for the gameover text; rebuilt only when
+  # the text changes, not every frame.
+  _gameover_render = None
 
   def __init__(self, display_width, display_height):
     self._display_width = display_width
@@ -269,6 +360,7 @@ class Game:
       self._gameover_text += '\'move %s\', \'go %s\' ' % (d, d)
       self._gameover_text +=  'or \'turn %s\'\n' % (d)
     self._gameover_text += '\n\n to control your snake.'
+    self._gameover_render = None
 
   def _update_gameover_text(self):
     self._gameover_text = ''
@@ -278,10 +370,9 @@ class Game:
       self.best_scores.insert(0, self.score)
       self.best_scores = self.best_scores[0:NUMBER_OF_SCORES_TO_KEEP]
     elif self.score > self.best_scores[len(self.best_scores) - 1]:
-      rank = NUMBER_OF_SCORES_TO_KEEP
-      for rank, best_score in enumerate(self.best_scores):
-        if self.score > best_score:
-          break
+      # best_scores is sorted descending, so bisect the negated list to find
+      # the rank in O(log n); ties rank the new score above older equal ones.
+      rank = bisect.bisect_left([-s for s in self.best_scores], -self.score)
       self.best_scores.insert(rank, self.score)
       self.best_scores = self.best_scores[0:NUMBER_OF_SCORES_TO_KEEP]
       self._gameover_text = ('You\'ve entered the hall of fame with {} points '
@@ -291,6 +382,7 @@ class Game:
           self.score)
     self._gameover_text += '\n' + self._best_scores_to_text()
     self._gameover_text += '\n\nSay \'launch game\' to start over!'
+    self._gameover_render = None
 
   def start(self):
     self._gameover = False
@@ -308,20 +400,24 @@ class Game:
     self.player.restart(length=3)
 
   def render_gameover_text(self, surface):
-    font = pygame.font.Font('freesansbold.ttf', 20)
-    rects = []
-    rendered_texts = []
-    for i, part in enumerate(self._gameover_text.split('\n')):
-      rendered_texts.append(font.render(part, True, GAMEOVER_TEXT_COLOR))
-      rects.append(rendered_texts[i].get_rect())
-    total_height = 0
-    for rect in rects:
-      total_height += rect.height
-    starting_y = self._display_height / 2 - total_height / 2
-    for i, rect in enumerate(rects):
-      rect.center = (self._display_width / 2, starting_y)
-      starting_y += rect.height
-      surface.blit(rendered_texts[i], rect)
+    if self._gameover_render is None:
+      # Constructing a Font reparses the TTF file; do it once and reuse.
+      if self._font is None:
+        self._font = pygame.font.Font('freesansbold.ttf', 20)
+      font = self._font
+      rendered_texts = [font.render(part, True, GAMEOVER_TEXT_COLOR)
+                        for part in self._gameover_text.split('\n')]
+      rects = [text.get_rect() for text in rendered_texts]
+      total_height = 0
+      for rect in rects:
+        total_height += rect.height
+      starting_y = self._display_height / 2 - total_height / 2
+      for rect in rects:
+        rect.center = (self._display_width / 2, starting_y)
+        starting_y += rect.height
+      self._gameover_render = list(zip(rendered_texts, rects))
+    for text, rect in self._gameover_render:
+      surface.blit(text, rect)
 
   def is_collision_rect_to_rect(self, x1, y1, size1, x2, y2, size2):
     if x1 + size1 > x2 and x1 < x2 + size2 and y1 + size1 > y2 and y1 < y2 + size2:
@@ -329,8 +425,8 @@ class Game:
     return False
 
   def _update_player_to_apple_dist(self):
-    self._snake_to_apple_dist = abs(self.player.x[0] -
-                                    self.apple.x) + abs(self.player.y[0] -
+    self._snake_to_apple_dist = abs(self.player.head_x -
+                                    self.apple.x) + abs(self.player.head_y -
                                                         self.apple.y)
 
   def _update_score(self):
@@ -373,20 +469,38 @@ class Game:
     self.player.update_position_immediately()
 
   def update(self):
-    self.player.update()
-
-    # does snake eat apple?
-    for i in range(0, self.player.length):
-      if self.is_collision_rect_to_rect(self.apple.x, self.apple.y,
-                                        self.apple.size, self.player.x[i],
-                                        self.player.y[i],
-                                        self.player.block_size):
-        self.eat_apple()
-
-    # does snake collide with itself?
-    for i in range(2, self.player.length):
-      if self.player.is_collision(i):
+    """Advances the game one tick; returns True if anything visible changed."""
+    changed = self.player.update()
+    player = self.player
+    apple = self.apple
+    block_size = player.block_size
+
+    # does snake eat apple? Only the head can reach the apple, so one rect
+    # test against the head replaces the scan over every body segment. The
+    # rect form is kept (rather than grid equality) because wrap-around can
+    # leave positions off the 30px grid.
+    if self.is_collision_rect_to_rect(apple.x, apple.y, apple.size,
+                                      player.head_x, player.head_y,
+                                      block_size):
+      self.eat_apple()
+      changed = True
+
+    # does snake collide with itself? (gathered after the apple branch:
+    # eating may have moved and grown the snake)
+    if player.length > 2:
+      body = player.segment_positions(start=2)
+      head = player.head_pos
+      # One broadcast of the head row against the packed body rows; both
+      # axes are compared in the same pass over contiguous memory.
+      hits = ((head >= body) & (head < body + block_size)).all(axis=1)
+      if hits.any():
         self.gameover()
+        changed = True
+    return changed
+
+  def dirty_rects(self):
+    """Screen areas the game draws into this frame (snake and apple)."""
+    return self.player.dirty_rects() + [self.apple.rect()]
 
   def draw(self, surface):
     self.player.draw(surface)
@@ -401,6 +515,24 @@ class Controler(object):
     def callback(self, command):
         self._q.put(command)
 
+
+def spotter(args, command_queue):
+  """Runs the keyword spotter and feeds detections into command_queue.
+
+  Module-level so it can be the target of a multiprocessing.Process (the
+  target must be picklable).
+  """
+  interpreter = model.make_interpreter(args.model_file)
+  interpreter.allocate_tensors()
+
+  mic = args.mic if args.mic is None else int(args.mic)
+  model.classify_audio(mic, interpreter,
+                       labels_file="config/labels_gc2.raw.txt",
+                       commands_file="config/commands_v2_snake.txt",
+                       dectection_callback=Controler(command_queue).callback,
+                       sample_rate_hz=int(args.sample_rate_hz),
+                       num_frames_hop=int(args.num_frames_hop))
+
 class App:
 
   window_width = 800
@@ -412,10 +544,16 @@ class App:
     self._display_text_rect = None
     self._display_score = None
     self._display_score_rect = None
+    self._font = None
+    self._last_rendered_score = None
     self._display_surf = None
     self._metadata_file = 'hearing_snake_metadata.json'
     self._metadata_data = None
     self._bg_image = None
+    self._clock = None
+    # Rects drawn last frame; None forces a full redraw (first frame and
+    # after the full-screen text pages).
+    self._last_dirty_rects = None
 
   def on_init(self):
     pygame.init()
@@ -429,6 +567,8 @@ class App:
     img = pygame.image.load('pygame_images/bg.jpg')
     img = pygame.transform.scale(img, (self.window_width, self.window_height))
     self._bg_image = img.convert()
+    self._font = pygame.font.Font('freesansbold.ttf', 20)
+    self._clock = pygame.time.Clock()
     self.on_load_metadata()
 
     self._running = True
@@ -464,89 +604,125 @@ class App:
       self._running = False
 
   def on_loop(self):
-    self.game.update()
+    return self.game.update()
 
   def on_display_score(self, color):
-    font = pygame.font.Font('freesansbold.ttf', 20)
-    self._display_score = font.render('Score: {}'.format(self.game.score), True,
-                                      color, None)
-    self._display_score_rect = self._display_score.get_rect()
-    self._display_score_rect = (self.window_width -
-                                self._display_score_rect.width - 10, 10)
+    # The score only changes on apple-eat events, so re-rasterize the text
+    # only when it does and blit the cached surface otherwise.
+    if self._last_rendered_score != self.game.score:
+      self._display_score = self._font.render(
+          'Score: {}'.format(self.game.score), True, color, None)
+      self._display_score_rect = (self.window_width -
+                                  self._display_score.get_rect().width - 10, 10)
+      self._last_rendered_score = self.game.score
     self._display_surf.blit(self._display_score, self._display_score_rect)
 
   def on_render(self):
-    self._display_surf.blit(self._bg_image, [0, 0])
-    self.game.draw(self._display_surf)
-    self.on_display_score(SCORE_TEXT_COLOR)
-    pygame.display.flip()
+    surface = self._display_surf
+    if self.game.started() and self._last_dirty_rects is not None:
+      # Dirty-rect path: repair the background only where the previous
+      # frame drew, redraw, and push just the union of old and new areas.
+      # For 30px sprites on an 800x600 window this touches a tiny fraction
+      # of the framebuffer compared to a full blit + flip.
+      for rect in self._last_dirty_rects:
+        surface.blit(self._bg_image, rect, rect)
+      self.game.draw(surface)
+      self.on_display_score(SCORE_TEXT_COLOR)
+      new_rects = self.game.dirty_rects()
+      new_rects.append(pygame.Rect(self._display_score_rect,
+                                   self._display_score.get_size()))
+      pygame.display.update(self._last_dirty_rects + new_rects)
+      self._last_dirty_rects = new_rects
+    else:
+      # Full redraw: first frame and the intro/gameover text pages, which
+      # cover most of the display anyway.
+      surface.blit(self._bg_image, [0, 0])
+      self.game.draw(surface)
+      self.on_display_score(SCORE_TEXT_COLOR)
+      pygame.display.flip()
+      self._last_dirty_rects = (
+          self.game.dirty_rects() if self.game.started() else None)
 
   def on_cleanup(self):
     self.on_save_metadata()
     pygame.quit()
 
-  def spotter(self, args):
-    interpreter = model.make_interpreter(args.model_file)
-    interpreter.allocate_tensors()
-
-    mic = args.mic if args.mic is None else int(args.mic)
-    model.classify_audio(mic, interpreter,
-                         labels_file="config/labels_gc2.raw.txt",
-                         commands_file="config/commands_v2_snake.txt",
-                         dectection_callback=self._controler.callback,
-                         sample_rate_hz=int(args.sample_rate_hz),
-                         num_frames_hop=int(args.num_frames_hop))
-
   def on_execute(self, args):
     if not self.on_init():
       self._running = False
 
-    q = model.get_queue()
-    self._controler = Controler(q)
-
+    # The classifier runs in its own process rather than a thread: its
+    # numpy/feature work would otherwise contend with the render loop for
+    # the GIL and cause frame hitches.
+    q = multiprocessing.Queue()
     if not args.debug_keyboard:
-      t = Thread(target=self.spotter, args=(args,))
-      t.daemon = True
-      t.start()
+      p = multiprocessing.Process(target=spotter, args=(args, q))
+      p.daemon = True
+      p.start()
 
     item = -1
+    # Render only when something on screen changed. The snake advances every
+    # third tick, so most 30Hz frames are pure idle and can skip drawing.
+    needs_render = True
+    # Hoisted out of the 30Hz loop: key codes are module-attribute lookups,
+    # and the bound pump/get_pressed methods cost a lookup per call.
+    debug_keyboard = args.debug_keyboard
+    key_codes = (pygame.K_ESCAPE, pygame.K_SPACE, pygame.K_RIGHT,
+                 pygame.K_LEFT, pygame.K_UP, pygame.K_DOWN)
+    event_pump = pygame.event.pump
+    get_pressed = pygame.key.get_pressed
+    key_escape = key_space = key_right = key_left = key_up = key_down = False
     while self._running:
-      pygame.event.pump()
-      if args.debug_keyboard:
-        keys = pygame.key.get_pressed()
+      event_pump()
+      if debug_keyboard:
+        # One snapshot, unpacked once; the command checks below then test
+        # plain locals instead of indexing the ScancodeWrapper six times.
+        keys = get_pressed()
+        key_escape, key_space, key_right, key_left, key_up, key_down = (
+            keys[key_codes[0]], keys[key_codes[1]], keys[key_codes[2]],
+            keys[key_codes[3]], keys[key_codes[4]], keys[key_codes[5]])
       else:
-        try:
-          new_item = q.get(True, 0.1)
-        except queue.Empty:
-          new_item = None
-
-        if new_item is not None:
-          item = new_item
-
-      if (args.debug_keyboard and keys[pygame.K_ESCAPE]) or item == "stop":
+        # Drain every pending command without blocking, so bursts from the
+        # recognizer are coalesced into this frame and command latency is
+        # one frame instead of up to get-timeout + sleep.
+        while True:
+          try:
+            item = q.get_nowait()
+          except queue.Empty:
+            break
+
+      if key_escape or item == "stop":
         self._running = False
 
-      if (args.debug_keyboard and keys[pygame.K_SPACE]) or item == "go":
+      if key_space or item == "go":
         self.game.start()
+        needs_render = True
+        # "go" is a one-shot command: clear it once acted on, or the sticky
+        # item would re-start the game and force a render every frame until
+        # the next command arrives, defeating the idle-frame skip below.
+        item = -1
 
       if self.game.started():
-        if (args.debug_keyboard and keys[pygame.K_RIGHT]) or item == "right":
+        if key_right or item == "right":
           self.game.player.move_right()
 
-        if (args.debug_keyboard and keys[pygame.K_LEFT]) or item == "left":
+        if key_left or item == "left":
           self.game.player.move_left()
 
-        if (args.debug_keyboard and keys[pygame.K_UP]) or item == "up":
+        if key_up or item == "up":
           self.game.player.move_up()
 
-        if (args.debug_keyboard and keys[pygame.K_DOWN]) or item == "down":
+        if key_down or item == "down":
           self.game.player.move_down()
 
-        self.on_loop()
+        if self.on_loop():
+          needs_render = True
 
-      self.on_render()
+      if needs_render:
+        self.on_render()
+        needs_render = False
 
-      time.sleep(0.05)
+      self._clock.tick(30)
     self.on_cleanup()
 
 
@@ -29,7 +29,9 @@ import numpy as np
 
 def print_results(result, commands, labels, top=3):
   """Example callback function that prints the passed detections."""
-  top_results = np.argsort(-result)[:top]
+  # O(N) top-k selection; only the k survivors get sorted for display order.
+  top_results = np.argpartition(result, -top)[-top:]
+  top_results = top_results[np.argsort(-result[top_results])]
   for p in range(top):
     l = labels[top_results[p]]
     if l in commands.keys():